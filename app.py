@@ -72,6 +72,10 @@ python run_agent.py --agent . --game lostpig -v -n 20
 ### 6. Submit your space URL
 """
 
+# Pre-concatenated page body so Gradio mounts a single Markdown component
+# instead of four separate render nodes.
+BODY = f"# {TITLE}\n\n{DESCRIPTION}\n\n---\n\n{CLONE_INSTRUCTIONS}"
+
 DATASET_REPO = "LLM-course/zork-submission"
 
 
@@ -128,14 +132,11 @@ def submit_space(space_url: str, profile: gr.OAuthProfile | None) -> str:
         return f"Error submitting: {str(e)}"
 
 
-demo = gr.Blocks(title=TITLE)
+demo = gr.Blocks(title=TITLE, analytics_enabled=False)
 
 with demo:
-    gr.Markdown(f"# {TITLE}")
-    gr.Markdown(DESCRIPTION)
-    gr.Markdown("---")
-    gr.Markdown(CLONE_INSTRUCTIONS)
-    
+    gr.Markdown(BODY)
+
     # Submission section
     gr.LoginButton()
     space_input = gr.Textbox(
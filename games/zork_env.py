@@ -173,13 +173,26 @@ class TextAdventureEnv:
                 "take all", "open mailbox", "read"
             ]
     
+    def get_dictionary(self) -> list[str]:
+        """Get the words understood by the game's parser."""
+        return self.env.get_dictionary()
+
     def save_state(self):
         """Save the current game state."""
         return self.env.get_state()
     
-    def load_state(self, state):
-        """Load a previously saved game state."""
+    def load_state(self, state, score: Optional[int] = None):
+        """
+        Load a previously saved game state.
+
+        Args:
+            state: A state previously returned by save_state
+            score: The score at save time; when given, the reward tracker is
+                   resynced so the next step doesn't report a bogus score delta
+        """
         self.env.set_state(state)
+        if score is not None:
+            self._last_score = score
     
     def get_walkthrough(self) -> list[str]:
         """Get the walkthrough for the game (for debugging/comparison only)."""
@@ -5,14 +5,30 @@ A complete MCP server that exposes text adventure games via tools.
 This demonstrates a full-featured server with memory, mapping, and inventory.
 """
 
+import bisect
+import functools
 import sys
 import os
-
-# Add parent directory to path to import games module
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import threading
+from collections import OrderedDict, deque
 
 from fastmcp import FastMCP
-from games.zork_env import TextAdventureEnv, list_available_games
+
+
+@functools.cache
+def _load_env_class():
+    """Import TextAdventureEnv on first use.
+
+    Jericho (and its spaCy setup) dominate import time, so the games module
+    is only pulled in when the first game is constructed rather than when
+    this module is imported.
+    """
+    # Add parent directory to path to import games module
+    parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if parent not in sys.path:
+        sys.path.insert(0, parent)
+    from games.zork_env import TextAdventureEnv
+    return TextAdventureEnv
 
 
 # Get game from environment variable (default: zork1)
@@ -21,62 +37,167 @@ INITIAL_GAME = os.environ.get("GAME", "zork1")
 # Create the MCP server
 mcp = FastMCP("Text Adventure Server")
 
+# Cap on named save slots; the oldest (least recently used) slot is
+# evicted when the limit is exceeded.
+MAX_SAVE_SLOTS = 32
+
+# Movement commands that can change the current location.
+_DIRECTIONS = frozenset({
+    "north", "south", "east", "west", "up", "down",
+    "enter", "exit", "n", "s", "e", "w", "u", "d",
+})
+
+
+@functools.lru_cache(maxsize=256)
+def _format_item(item_str: str) -> str:
+    """Strip Jericho object-tree noise ("obj: name Parent...") down to the item name."""
+    item_lower = item_str.lower()
+    if "parent" in item_lower:
+        idx = item_lower.index("parent")
+        name = item_str[:idx].strip()
+        if ":" in name:
+            name = name.split(":", 1)[1].strip()
+        return name
+    if ":" in item_str:
+        return item_str.split(":")[1].strip()
+    return item_str
+
 
 class GameState:
     """Manages the text adventure game state and exploration data."""
-    
+
+    # The single long-lived object every tool call touches; slots drop the
+    # per-instance __dict__ and make the frequent attribute lookups cheaper.
+    __slots__ = (
+        "game_name", "env", "state", "_recent_lines",
+        "explored_locations", "_explored_edges", "_map_locations_sorted",
+        "current_location", "saved_states", "_autosave",
+        "_vocab_index", "_valid_actions_formatted", "_inv_cache",
+        "_mem_tmpl", "_step_lock",
+    )
+
     def __init__(self, game: str = "zork1"):
         self.game_name = game
-        self.env = TextAdventureEnv(game)
+        self.env = _load_env_class()(game)
         self.state = self.env.reset()
-        self.history: list[tuple[str, str]] = []
-        self.explored_locations: dict[str, set[str]] = {}
+        # Pre-formatted lines for the "Recent Actions" part of get_memory,
+        # updated incrementally so memory() never reformats old history.
+        # Only the 60-char truncations are kept; holding full observations
+        # (KBs each) accumulated megabytes of text nothing ever read.
+        self._recent_lines: deque = deque(maxlen=5)
+        # Exits per location, kept sorted on insert so get_map never sorts.
+        self.explored_locations: dict[str, list[str]] = {}
+        self._explored_edges: dict[str, set[str]] = {}  # Dedup for the sorted lists
+        self._map_locations_sorted: list[str] = []
         self.current_location: str = self._extract_location(self.state.observation)
-        self.saved_states = {}  # Dictionary to store saved game states
-    
+        self.saved_states: OrderedDict = OrderedDict()  # Named save slots (LRU-bounded)
+        # Ring buffer of (moves, state blob) autosaves, one per action.
+        # Jericho state blobs are compact serialized buffers, so keeping
+        # the last 64 steps is cheap.
+        self._autosave: deque = deque(maxlen=64)
+        # The Z-machine dictionary never changes during a game, so index it
+        # once on first use by 6-char prefix (see check_vocabulary).
+        self._vocab_index: dict[str, list[str]] | None = None
+        # env.get_valid_actions() is expensive (it probes the Z-machine with
+        # many candidate commands), so cache the result until the world
+        # state changes.
+        self._valid_actions_formatted: str | None = None
+        # Cached formatted inventory string; cleared whenever the env steps.
+        self._inv_cache: str | None = None
+        # Memory summary template with the static parts (including the game
+        # name) baked in; get_memory only fills the dynamic fields.
+        self._mem_tmpl = (
+            "Current State:\n"
+            "    - Location: %s\n"
+            "    - Score: %s points\n"
+            "    - Moves: %s\n"
+            "    - Game: " + self.game_name + "\n"
+            "\n"
+            "    Recent Actions:\n"
+            "    %s\n"
+            "\n"
+            "    Current Observation:\n"
+            "    %s"
+        )
+        # Serializes env access: FastMCP may dispatch tool calls
+        # concurrently and interleaved Z-machine steps corrupt the game.
+        self._step_lock = threading.Lock()
+
     def _extract_location(self, observation: str) -> str:
         """Extract location name from observation (usually first line)."""
-        lines = observation.strip().split('\n')
-        return lines[0] if lines else "Unknown"
+        # lstrip first: raw Frotz output often opens with a newline, and
+        # partitioning before stripping would take the empty segment.
+        head, _, _ = observation.lstrip().partition('\n')
+        head = head.rstrip()
+        # Location names recur constantly as map keys over a long game;
+        # interning makes the repeats share one object and hash by identity.
+        return sys.intern(head) if head else "Unknown"
     
     def take_action(self, action: str) -> str:
         """Execute a game action and return the result."""
-        self.state = self.env.step(action)
-        result = self.state.observation
-        
-        # Track history
-        self.history.append((action, result))
-        if len(self.history) > 50:
-            self.history = self.history[-50:]
-        
-        # Update map
-        new_location = self._extract_location(result)
-        if action in ["north", "south", "east", "west", "up", "down", 
-                      "enter", "exit", "n", "s", "e", "w", "u", "d"]:
-            if self.current_location not in self.explored_locations:
-                self.explored_locations[self.current_location] = set()
-            if new_location != self.current_location:
-                self.explored_locations[self.current_location].add(f"{action} -> {new_location}")
-        self.current_location = new_location
-        
-        return result
+        # The Z-machine is not reentrant; serialize concurrent tool calls.
+        with self._step_lock:
+            self.state = self.env.step(action)
+            result = self.state.observation
+            self._valid_actions_formatted = None
+            self._inv_cache = None
+
+            # Autosave so any recent step can be restored via restore_step.
+            # The GameState rides along so restoring never needs an extra
+            # Z-machine step to refresh the observation.
+            try:
+                self._autosave.append((self.state.moves, self.env.save_state(), self.state))
+            except Exception:
+                pass  # Autosaving is best-effort; never fail the action itself.
+
+            # Track recent actions (deque evicts the oldest entry past 5)
+            self._recent_lines.append(f"  > {action} -> {result[:60]}...")
+
+            # Update map; only movement can change the location, so skip the
+            # observation parse entirely for other actions.
+            if action in _DIRECTIONS:
+                new_location = self._extract_location(result)
+                if self.current_location not in self.explored_locations:
+                    self.explored_locations[self.current_location] = []
+                    self._explored_edges[self.current_location] = set()
+                    bisect.insort(self._map_locations_sorted, self.current_location)
+                if new_location != self.current_location:
+                    # Edge strings come from a finite direction x location
+                    # vocabulary, so intern them too.
+                    edge = sys.intern(f"{action} -> {new_location}")
+                    edges = self._explored_edges[self.current_location]
+                    if edge not in edges:
+                        edges.add(edge)
+                        bisect.insort(self.explored_locations[self.current_location], edge)
+                    self.current_location = new_location
+
+            return result
     
-    def get_memory(self) -> str:
-        """Get a summary of current game state."""
-        recent = self.history[-5:] if self.history else []
-        recent_str = "\n".join([f"  > {a} -> {r[:60]}..." for a, r in recent]) if recent else "  (none yet)"
-        
-        return f"""Current State:
-    - Location: {self.current_location}
-    - Score: {self.state.score} points
-    - Moves: {self.state.moves}
-    - Game: {self.game_name}
+    def take_action_with_meta(self, action: str) -> str:
+        """Execute an action and return the response with score/move info appended."""
+        result = self.take_action(action)
+        state = self.state
+
+        if state.reward > 0:
+            score_info = f"\n\n+{state.reward} points! (Total: {state.score})"
+        else:
+            score_info = f"\n\n[Score: {state.score} | Moves: {state.moves}]"
 
-    Recent Actions:
-    {recent_str}
+        if state.done:
+            return "".join((result, score_info, "\n\nGAME OVER"))
+        return result + score_info
 
-    Current Observation:
-    {self.state.observation}"""
+    def get_memory(self) -> str:
+        """Get a summary of current game state."""
+        recent_str = "\n".join(self._recent_lines) or "  (none yet)"
+
+        return self._mem_tmpl % (
+            self.current_location,
+            self.state.score,
+            self.state.moves,
+            recent_str,
+            self.state.observation,
+        )
     
     def get_map(self) -> str:
         """Get a map of explored locations."""
@@ -84,9 +205,9 @@ class GameState:
             return "Map: No locations explored yet. Try moving around!"
         
         lines = ["Explored Locations and Exits:"]
-        for loc, exits in sorted(self.explored_locations.items()):
+        for loc in self._map_locations_sorted:
             lines.append(f"\n* {loc}")
-            for exit_info in sorted(exits):
+            for exit_info in self.explored_locations[loc]:
                 lines.append(f"    -> {exit_info}")
         
         lines.append(f"\n[Current] {self.current_location}")
@@ -94,97 +215,210 @@ class GameState:
     
     def get_inventory(self) -> str:
         """Get current inventory."""
+        # The inventory only changes when the env steps, so the formatted
+        # string is cached until take_action/load_game invalidates it.
+        if self._inv_cache is not None:
+            return self._inv_cache
+
         items = self.state.inventory if hasattr(self.state, 'inventory') and self.state.inventory else []
-        
+
         if not items:
-            return "Inventory: You are empty-handed."
-        
-        item_names = []
-        for item in items:
-            item_str = str(item)
-            item_lower = item_str.lower()
-            if "parent" in item_lower:
-                idx = item_lower.index("parent")
-                name = item_str[:idx].strip()
-                if ":" in name:
-                    name = name.split(":", 1)[1].strip()
-                item_names.append(name)
-            elif ":" in item_str:
-                name = item_str.split(":")[1].strip()
-                item_names.append(name)
-            else:
-                item_names.append(item_str)
-        
-        return f"Inventory: {', '.join(item_names)}"
+            result = "Inventory: You are empty-handed."
+        else:
+            result = f"Inventory: {', '.join(_format_item(str(item)) for item in items)}"
+
+        self._inv_cache = result
+        return result
     
     def get_valid_actions(self) -> str:
         """Get list of valid actions available in current state."""
+        if self._valid_actions_formatted is not None:
+            return self._valid_actions_formatted
         try:
-            import sys
             sys.stderr.write("[DEBUG] Calling env.get_valid_actions()...\n")
             sys.stderr.flush()
-            
-            actions = self.env.get_valid_actions()
-            
+
+            # Jericho probes candidate commands by stepping the Z-machine
+            # and save/restoring around each, so this needs the same
+            # serialization as take_action.
+            with self._step_lock:
+                actions = self.env.get_valid_actions()
+
             sys.stderr.write(f"[DEBUG] Got {len(actions)} actions\n")
             sys.stderr.flush()
-            
+
             if not actions:
-                return "No valid actions available."
-            return "Valid Actions:\n" + "\n".join(f"  - {action}" for action in actions)
+                formatted = "No valid actions available."
+            else:
+                formatted = "Valid Actions:\n" + "\n".join(f"  - {action}" for action in actions)
+            self._valid_actions_formatted = formatted
+            return formatted
         except Exception as e:
-            import sys
             sys.stderr.write(f"[ERROR] get_valid_actions failed: {e}\n")
             sys.stderr.flush()
             return f"Could not retrieve valid actions: {e}"
     
     def check_vocabulary(self, word: str) -> str:
         """Check if a specific word is understood by the game engine."""
-        try:
-            vocab = self.env.get_dictionary()
-            # Jericho dictionaries often store the first 6-9 characters of a word
-            # due to Z-machine limitations, so check for partial matches.
-            word_lower = word.lower()
-            matches = [w for w in vocab if w.startswith(word_lower[:6])]
-            
-            if matches:
-                return f"Yes, the game understands '{word}' (matches: {', '.join(matches)})."
-            return f"No, the game does NOT understand the word '{word}'. Try a different synonym."
-        except Exception as e:
-            return f"Could not check vocabulary: {e}"
+        if self._vocab_index is None:
+            try:
+                # Jericho dictionaries often store the first 6-9 characters of a word
+                # due to Z-machine limitations, so index words by 6-char prefix.
+                idx: dict[str, list[str]] = {}
+                for w in self.env.get_dictionary():
+                    idx.setdefault(w[:6].lower(), []).append(w)
+                self._vocab_index = idx
+            except Exception as e:
+                # Failures are not cached: the next call retries the fetch.
+                return f"Could not check vocabulary: {e}"
+
+        matches = self._vocab_index.get(word.lower()[:6], [])
+        if matches:
+            return f"Yes, the game understands '{word}' (matches: {', '.join(matches)})."
+        return f"No, the game does NOT understand the word '{word}'. Try a different synonym."
     
     def save_game(self, slot_name: str) -> str:
         """Save the current game state to a named slot."""
-        try:
-            self.saved_states[slot_name] = self.env.get_state()
-            return f"Game saved successfully to slot: '{slot_name}'"
-        except Exception as e:
-            return f"Error saving game to slot '{slot_name}': {e}"
-    
+        with self._step_lock:
+            try:
+                self.saved_states[slot_name] = (self.env.save_state(), self.state)
+                self.saved_states.move_to_end(slot_name)
+                while len(self.saved_states) > MAX_SAVE_SLOTS:
+                    self.saved_states.popitem(last=False)
+                return f"Game saved successfully to slot: '{slot_name}'"
+            except Exception as e:
+                return f"Error saving game to slot '{slot_name}': {e}"
+
     def load_game(self, slot_name: str) -> str:
         """Load a previously saved game state from a named slot."""
         if slot_name not in self.saved_states:
             return f"Error: No save found in slot '{slot_name}'"
+        with self._step_lock:
+            try:
+                blob, saved_state = self.saved_states[slot_name]
+                self.env.load_state(blob, score=saved_state.score)
+                self.saved_states.move_to_end(slot_name)
+                self._drop_autosaves_after(saved_state.moves)
+                self._valid_actions_formatted = None
+                self._inv_cache = None
+                # The saved GameState already holds the observation at save
+                # time; stepping "look" here would burn a Z-machine move.
+                self.state = saved_state
+                self.current_location = self._extract_location(self.state.observation)
+                return f"Game loaded from slot: '{slot_name}'.\nCurrent location: {self.state.observation}"
+            except Exception as e:
+                return f"Error loading game from slot '{slot_name}': {e}"
+
+    def _drop_autosaves_after(self, moves: int) -> None:
+        """Discard autosaves newer than a restored state.
+
+        Rewinding and playing on would otherwise append lower move counts
+        after higher ones, breaking the sorted invariant restore_step's
+        bisect relies on (and keeping abandoned-timeline snapshots around).
+        """
+        while self._autosave and self._autosave[-1][0] > moves:
+            self._autosave.pop()
+
+    def restore_step(self, step_id: int) -> str:
+        """Restore the autosave taken at (or just before) a given move number."""
+        with self._step_lock:
+            snapshots = list(self._autosave)
+            if not snapshots:
+                return "Error: No autosaved steps available yet."
+            moves = [snap[0] for snap in snapshots]
+            idx = bisect.bisect_right(moves, step_id) - 1
+            if idx < 0:
+                return f"Error: No autosave at or before step {step_id} (oldest is step {moves[0]})"
+            step, blob, saved_state = snapshots[idx]
+            try:
+                self.env.load_state(blob, score=saved_state.score)
+                self._drop_autosaves_after(saved_state.moves)
+                self._valid_actions_formatted = None
+                self._inv_cache = None
+                self.state = saved_state
+                self.current_location = self._extract_location(self.state.observation)
+                return f"Restored autosave from step {step}.\n{self.state.observation}"
+            except Exception as e:
+                return f"Error restoring step {step_id}: {e}"
+
+    def branch_from(self, slot_name: str, actions: list[str]) -> str:
+        """Replay actions from a saved slot on a pooled env.
+
+        The live game is untouched, so this can be used to peek at "what
+        would happen if..." without spending moves or risking death.
+        """
+        if slot_name not in self.saved_states:
+            return f"Error: No save found in slot '{slot_name}'"
+        if not actions:
+            return "Error: No actions given to branch with."
+        blob, state = self.saved_states[slot_name]
+        pool = _env_pool()
+        env = pool.acquire()
         try:
-            self.env.set_state(self.saved_states[slot_name])
-            # Refresh the observation after loading
-            self.state = self.env.step("look")
-            self.current_location = self._extract_location(self.state.observation)
-            return f"Game loaded from slot: '{slot_name}'.\nCurrent location: {self.state.observation}"
+            env.load_state(blob, score=state.score)
+            lines = [f"Branching from slot '{slot_name}':"]
+            for act in actions:
+                state = env.step(act)
+                lines.append(f"> {act}\n{state.observation}")
+                if state.done:
+                    lines.append("GAME OVER")
+                    break
+            lines.append(f"[Branch score: {state.score} | Moves: {state.moves}]")
+            return "\n\n".join(lines)
         except Exception as e:
-            return f"Error loading game from slot '{slot_name}': {e}"
+            return f"Error branching from slot '{slot_name}': {e}"
+        finally:
+            pool.release(env)
+
+
+class EnvPool:
+    """A small pool of reusable game environments for snapshot branching.
+
+    Constructing a TextAdventureEnv is the expensive part (Z-machine load),
+    so branching checks an env out, restores a save blob into it, and hands
+    it back afterwards instead of rebuilding an env per branch.
+    """
+
+    def __init__(self, game: str, size: int = 4):
+        self.game = game
+        self.size = size
+        self._lock = threading.Lock()
+        self._envs: deque = deque()
+
+    def acquire(self):
+        """Check out an env, building one lazily if the pool is empty."""
+        with self._lock:
+            if self._envs:
+                return self._envs.popleft()
+        env = _load_env_class()(self.game)
+        env.reset()
+        return env
 
+    def release(self, env) -> None:
+        """Return an env to the pool (dropped if the pool is already full)."""
+        with self._lock:
+            if len(self._envs) < self.size:
+                self._envs.append(env)
 
-# Global game state
-_game_state: GameState | None = None
+
+# Global game state, built exactly once even under concurrent tool calls
+_init_lock = threading.Lock()
+
+
+@functools.cache
+def _build_game() -> GameState:
+    return GameState(INITIAL_GAME)
+
+
+@functools.cache
+def _env_pool() -> EnvPool:
+    return EnvPool(INITIAL_GAME)
 
 
 def get_game() -> GameState:
     """Get or initialize the game state."""
-    global _game_state
-    if _game_state is None:
-        _game_state = GameState(INITIAL_GAME)
-    return _game_state
+    with _init_lock:
+        return _build_game()
 
 
 # =============================================================================
@@ -202,20 +436,7 @@ def play_action(action: str) -> str:
     Returns:
         The game's response to your action
     """
-    game = get_game()
-    result = game.take_action(action)
-
-    # Add score info
-    score_info = f"\n\n[Score: {game.state.score} | Moves: {game.state.moves}]"
-    
-    if game.state.reward > 0:
-        score_info = f"\n\n+{game.state.reward} points! (Total: {game.state.score})"
-    
-    done_info = ""
-    if game.state.done:
-        done_info = "\n\nGAME OVER"
-    
-    return result + score_info + done_info
+    return get_game().take_action_with_meta(action)
 
 
 @mcp.tool()
@@ -293,6 +514,41 @@ def load_state(slot_name: str) -> str:
     return get_game().load_game(slot_name)
 
 
+@mcp.tool()
+def restore_step(step_id: int) -> str:
+    """
+    Restore the game to an automatically saved step (by move number).
+
+    The last 64 steps are autosaved after every action, so you can rewind
+    without having saved manually.
+
+    Args:
+        step_id: The move number to restore (the closest earlier autosave is used)
+
+    Returns:
+        Confirmation message with current location
+    """
+    return get_game().restore_step(step_id)
+
+
+@mcp.tool()
+def branch_from(slot_name: str, actions: list[str]) -> str:
+    """
+    Try a sequence of actions from a saved slot WITHOUT affecting the live game.
+
+    Useful for exploring risky options: save a slot, branch a few candidate
+    action sequences from it, then commit to the best one in the real game.
+
+    Args:
+        slot_name: Name of the save slot to branch from
+        actions: The sequence of commands to try (e.g., ["open door", "north"])
+
+    Returns:
+        The observations from replaying the actions on a scratch copy
+    """
+    return get_game().branch_from(slot_name, actions)
+
+
 # =============================================================================
 # Main
 # =============================================================================